@@ -1,5 +1,5 @@
-from imap_client import fetch_all_emails, search_emails
-from semantic_search import semantic_search_emails, semantic_search_with_scores
+from imap_client import fetch_all_emails, fetch_email, search_emails
+from semantic_search import filter_ranked, get_semantic_engine
 from dotenv import load_dotenv
 import os
 import sys
@@ -92,6 +92,12 @@ def display_summary_with_scores(results):
         print(f"Subject: {email_['subject']}")
         print(f"Date: {email_['date']}")
 
+def load_full_email(imap_host, email_user, email_pass, email_):
+    """Re-fetch the complete message when the listing only holds a preview."""
+    if email_.get("partial") and email_.get("uid"):
+        return fetch_email(imap_host, email_user, email_pass, email_["uid"])
+    return email_
+
 def display_full_email(email_):
     print("\n" + "=" * 80)
     print("📧 FULL EMAIL CONTENT")
@@ -120,6 +126,9 @@ def run_cli():
 
     imap_host, email_user, email_pass = get_credentials()
 
+    # Emails loaded in this session, reused by semantic search
+    session_emails = None
+
     while True:
         print("\nChoose an option:")
         print("1. Fetch all emails")
@@ -133,13 +142,14 @@ def run_cli():
             if choice == "1":
                 print("Fetching all emails...")
                 emails = fetch_all_emails(imap_host, email_user, email_pass)
+                session_emails = emails
                 display_one_line_summary(emails)
 
                 index = input("\nEnter email number to view full content (or press Enter to skip): ")
                 if index.isdigit():
                     index = int(index)
                     if 1 <= index <= len(emails):
-                        display_full_email(emails[index - 1])
+                        display_full_email(load_full_email(imap_host, email_user, email_pass, emails[index - 1]))
                     else:
                         print("Invalid index.")
                 else:
@@ -171,51 +181,64 @@ def run_cli():
                     print("Please enter a valid search query.")
                     continue
                 
-                # Ask for threshold (optional)
-                threshold_input = input("Enter similarity threshold (0.0-1.0, default 0.1, press Enter to skip): ").strip()
-                min_threshold = 0.1  # Default threshold
-                
-                if threshold_input:
-                    try:
-                        min_threshold = float(threshold_input)
-                        if min_threshold < 0.0 or min_threshold > 1.0:
-                            print("Invalid threshold, using default 0.1")
-                            min_threshold = 0.1
-                    except ValueError:
-                        print("Invalid threshold format, using default 0.1")
-                        min_threshold = 0.1
-                
-                print(f"\n🔍 Performing semantic search for: '{query}'")
-                print(f"📊 Using similarity threshold: {min_threshold:.3f}")
-                print("⏳ This may take a moment while we process the emails...")
-                
                 try:
-                    # Get results with similarity scores and threshold
-                    results = semantic_search_with_scores(imap_host, email_user, email_pass, query, top_k=8, min_threshold=min_threshold)
+                    # Reuse the emails already loaded in this session; their embeddings stay cached
+                    if session_emails is None:
+                        print("📥 Fetching emails for this session...")
+                        session_emails = fetch_all_emails(imap_host, email_user, email_pass)
+                    
+                    print(f"\n🔍 Performing semantic search for: '{query}'")
+                    print("⏳ This may take a moment while we process the emails...")
                     
-                    if results:
-                        # Show model info on first result
-                        from semantic_search import get_semantic_engine
-                        engine = get_semantic_engine()
-                        print(f"\n✅ Found {len(results)} semantically similar email(s) above threshold {min_threshold:.3f}:")
-                        print(f"🤖 Model: {engine.model_name}")
-                        print("📈 Scores: 🟢 High (≥0.5) | 🟡 Medium (≥0.3) | 🟠 Low (≥0.1) | 🔴 Very Low (<0.1)")
-                        display_summary_with_scores(results)
+                    # Rank once; trying other thresholds below only re-filters this list
+                    engine = get_semantic_engine()
+                    ranked = engine.rank(query, session_emails)
+                    
+                    while True:
+                        # Ask for threshold (optional)
+                        threshold_input = input("Enter similarity threshold (0.0-1.0, default 0.1, press Enter to skip): ").strip()
+                        min_threshold = 0.1  # Default threshold
+                        
+                        if threshold_input:
+                            try:
+                                min_threshold = float(threshold_input)
+                                if min_threshold < 0.0 or min_threshold > 1.0:
+                                    print("Invalid threshold, using default 0.1")
+                                    min_threshold = 0.1
+                            except ValueError:
+                                print("Invalid threshold format, using default 0.1")
+                                min_threshold = 0.1
+                        
+                        print(f"📊 Using similarity threshold: {min_threshold:.3f}")
                         
-                        index = input("\nEnter email number to view full content (or press Enter to skip): ")
-                        if index.isdigit():
-                            index = int(index)
-                            if 1 <= index <= len(results):
-                                email_, score = results[index - 1]
-                                print(f"\n📊 [Detailed Similarity Score: {score:.6f}]")
-                                display_full_email(email_)
+                        # Get results with similarity scores and threshold
+                        results = filter_ranked(ranked, min_threshold, top_k=8)
+                        
+                        if results:
+                            # Show model info on first result
+                            print(f"\n✅ Found {len(results)} semantically similar email(s) above threshold {min_threshold:.3f}:")
+                            print(f"🤖 Model: {engine.model_name} ({engine.backend})")
+                            print("📈 Scores: 🟢 High (≥0.5) | 🟡 Medium (≥0.3) | 🟠 Low (≥0.1) | 🔴 Very Low (<0.1)")
+                            display_summary_with_scores(results)
+                            
+                            index = input("\nEnter email number to view full content (or press Enter to skip): ")
+                            if index.isdigit():
+                                index = int(index)
+                                if 1 <= index <= len(results):
+                                    email_, score = results[index - 1]
+                                    print(f"\n📊 [Detailed Similarity Score: {score:.6f}]")
+                                    display_full_email(load_full_email(imap_host, email_user, email_pass, email_))
+                                else:
+                                    print("Invalid index.")
                             else:
-                                print("Invalid index.")
+                                print("Skipping full view.")
                         else:
-                            print("Skipping full view.")
-                    else:
-                        print(f"❌ No semantically similar emails found above threshold {min_threshold:.3f}.")
-                        print("💡 Try lowering the threshold or using different search terms.")
+                            print(f"❌ No semantically similar emails found above threshold {min_threshold:.3f}.")
+                            print("💡 Try lowering the threshold or using different search terms.")
+                        
+                        retry = input("\nTry another threshold for this query? (y/N): ").strip().lower()
+                        if retry != "y":
+                            break
                 except Exception as e:
                     print(f"❌ Error during semantic search: {e}")
                     print("💡 Note: First-time semantic search may take longer to download the model.")
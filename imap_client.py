@@ -1,54 +1,505 @@
 import imaplib
 import email
+import re
+import atexit
+import os
+import hashlib
+import hmac
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.header import decode_header
+from email.parser import BytesHeaderParser
+from email import policy
 from datetime import datetime
 
+# Providers drop idle IMAP sessions after ~30 minutes, so check with NOOP before that
+IDLE_REFRESH_SECONDS = 25 * 60
+
+# (host, user, folder) -> (connection, password digest, last use); one lock per entry.
+# Each folder gets its own session, so different folders can be fetched concurrently.
+_imap_pool = {}
+_imap_locks = {}
+_imap_pool_lock = threading.Lock()
+# (host, user) -> logins in progress, counted against MAX_FOLDER_CONNECTIONS
+_imap_logins = {}
+
+# Listings only need headers and the start of the body, not attachments
+PREVIEW_FETCH_BYTES = 4096
+PREVIEW_FETCH = f"(BODY.PEEK[HEADER] BODY.PEEK[TEXT]<0.{PREVIEW_FETCH_BYTES}>)"
+FULL_FETCH = "(BODY.PEEK[])"
+
+_FETCH_SECTION = re.compile(rb"BODY\[([^\]]*)\](?:<\d+>)? \{\d+\}$")
+_HEADER_PARSER = BytesHeaderParser(policy=policy.default)
+
+_FETCH_START = re.compile(rb"^\d+ \(")
+_FETCH_UID = re.compile(rb"UID (\d+)")
+_FETCH_INTERNALDATE = re.compile(rb'INTERNALDATE "([^"]+)"')
+
+# Messages per UID FETCH round trip, and threads parsing fetched chunks
+FETCH_CHUNK_SIZE = 50
+PARSE_WORKERS = 4
+
+# Upper bound on IMAP sessions per account (Gmail allows 15), both pooled and in
+# use; beyond it the least recently used idle session is re-selected on another folder
+MAX_FOLDER_CONNECTIONS = 4
+
+# Parsed complete messages, keyed by account/folder/UIDVALIDITY/UID/INTERNALDATE so a
+# message is only downloaded and decoded once; sqlite lets the CLI and web workers
+# share the file. Set to None to disable.
+MESSAGE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".mail-cli", "messages.sqlite")
+_message_cache = None
+_message_cache_lock = threading.Lock()
+
 def login_to_email(imap_host, email_user, email_pass):
     mail = imaplib.IMAP4_SSL(imap_host)
     mail.login(email_user, email_pass)
     return mail
 
-def fetch_all_emails(imap_host, email_user, email_pass, folder="INBOX"):
-    mail = login_to_email(imap_host, email_user, email_pass)
-    mail.select(folder)
-    _, data = mail.search(None, "ALL")
-    email_ids = data[0].split()
+def _password_digest(email_pass):
+    return hashlib.sha256(email_pass.encode("utf-8")).digest()
+
+def _connection_lock(imap_host, email_user, folder):
+    with _imap_pool_lock:
+        return _imap_locks.setdefault((imap_host, email_user, folder), threading.Lock())
+
+def get_connection(imap_host, email_user, email_pass, folder="INBOX"):
+    """Return a logged-in connection for (host, user, folder), reusing a pooled one when possible."""
+    key = (imap_host, email_user, folder)
+    with _imap_pool_lock:
+        entry = _imap_pool.get(key)
+    mail = None
+    if entry is not None:
+        cached_mail, pass_digest, last_used = entry
+        # Only hand out the pooled session to callers that know the password
+        if hmac.compare_digest(pass_digest, _password_digest(email_pass)):
+            mail = cached_mail
+            if not _is_alive(mail, last_used):
+                drop_connection(imap_host, email_user, folder)
+                mail = None
+
+    if mail is None:
+        mail = _reserve_session(imap_host, email_user, email_pass, key)
+        if mail is None:
+            try:
+                mail = login_to_email(imap_host, email_user, email_pass)
+                _pool_put(key, mail, email_pass)
+            finally:
+                with _imap_pool_lock:
+                    _imap_logins[key[:2]] -= 1
+            return mail
+
+    _pool_put(key, mail, email_pass)
+    return mail
+
+def _pool_put(key, mail, email_pass):
+    # Store mail as the pooled session of key, logging out the one it replaces
+    with _imap_pool_lock:
+        old = _imap_pool.get(key)
+        _imap_pool[key] = (mail, _password_digest(email_pass), time.monotonic())
+    if old is not None and old[0] is not mail:
+        _logout_quietly(old[0])
+
+def _reserve_session(imap_host, email_user, email_pass, key):
+    # Find a session for key without going over MAX_FOLDER_CONNECTIONS for the account.
+    # Below the cap a login is counted and None returned; at the cap the least recently
+    # used idle session is taken over instead (callers SELECT their folder anyway), so
+    # working with many folders does not mean logging in again. Sessions in use (their
+    # lock is held) are skipped and waited for; the caller holds the lock of key.
+    account = (imap_host, email_user)
+    pass_digest = _password_digest(email_pass)
+    while True:
+        with _imap_pool_lock:
+            sessions = sorted(
+                (last_used, pool_key) for pool_key, (_, _, last_used) in _imap_pool.items()
+                if pool_key[:2] == account and pool_key != key
+            )
+            if len(sessions) + _imap_logins.get(account, 0) < MAX_FOLDER_CONNECTIONS:
+                _imap_logins[account] = _imap_logins.get(account, 0) + 1
+                return None
+        for _, pool_key in sessions:
+            lock = _connection_lock(*pool_key)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                # Move the session to key in one step, so it is counted throughout
+                with _imap_pool_lock:
+                    entry = _imap_pool.pop(pool_key, None)
+                    replaced = None
+                    if entry is not None and hmac.compare_digest(entry[1], pass_digest):
+                        replaced = _imap_pool.pop(key, None)
+                        _imap_pool[key] = entry
+            finally:
+                lock.release()
+            if entry is None:
+                break
+            if replaced is not None:
+                _logout_quietly(replaced[0])
+            mail, digest, last_used = entry
+            if not hmac.compare_digest(digest, pass_digest):
+                _logout_quietly(mail)
+            elif _is_alive(mail, last_used):
+                return mail
+            else:
+                drop_connection(*key)
+            break
+        else:
+            time.sleep(0.05)
+
+def _is_alive(mail, last_used):
+    # Sessions idle for longer than IDLE_REFRESH_SECONDS are checked with NOOP
+    if time.monotonic() - last_used <= IDLE_REFRESH_SECONDS:
+        return True
+    try:
+        mail.noop()
+        return True
+    except (imaplib.IMAP4.error, OSError):
+        return False
+
+def drop_connection(imap_host, email_user, folder="INBOX"):
+    with _imap_pool_lock:
+        entry = _imap_pool.pop((imap_host, email_user, folder), None)
+    if entry is not None:
+        _logout_quietly(entry[0])
+
+def close_all_connections():
+    with _imap_pool_lock:
+        keys = list(_imap_pool)
+    for imap_host, email_user, folder in keys:
+        drop_connection(imap_host, email_user, folder)
+
+atexit.register(close_all_connections)
+
+def _open_message_cache():
+    # Called with _message_cache_lock held; reopens the file if it was deleted meanwhile
+    global _message_cache
+    if not MESSAGE_CACHE_PATH:
+        return None
+    if _message_cache is not None and not os.path.exists(MESSAGE_CACHE_PATH):
+        _message_cache.close()
+        _message_cache = None
+    if _message_cache is None:
+        # The cache holds complete message bodies, so keep it private to the user
+        os.makedirs(os.path.dirname(MESSAGE_CACHE_PATH), mode=0o700, exist_ok=True)
+        _message_cache = sqlite3.connect(MESSAGE_CACHE_PATH, timeout=30, check_same_thread=False)
+        _message_cache.execute(
+            "CREATE TABLE IF NOT EXISTS messages (msg_key TEXT PRIMARY KEY, folder TEXT, parsed TEXT)"
+        )
+        _message_cache.execute("CREATE INDEX IF NOT EXISTS messages_folder ON messages (folder)")
+        _message_cache.commit()
+    return _message_cache
+
+def _load_cached_messages(keys, chunk_size=500):
+    # {key: parsed message} for the keys found in the message cache
+    cached = {}
+    with _message_cache_lock:
+        cache = _open_message_cache()
+        if cache is None:
+            return cached
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = cache.execute(
+                f"SELECT msg_key, parsed FROM messages WHERE msg_key IN ({placeholders})", chunk
+            )
+            for key, parsed in cursor:
+                cached[key] = json.loads(parsed)
+    return cached
+
+def _store_messages(folder_key, messages):
+    # Write (key, parsed message) pairs of one account/folder to the message cache
+    with _message_cache_lock:
+        cache = _open_message_cache()
+        if cache is None:
+            return
+        cache.executemany(
+            "INSERT OR REPLACE INTO messages (msg_key, folder, parsed) VALUES (?, ?, ?)",
+            [(key, folder_key, json.dumps(parsed)) for key, parsed in messages]
+        )
+        cache.commit()
+
+def _prune_messages(folder_key, live_keys):
+    # Delete cached messages of one account/folder that are no longer on the server,
+    # or whose UIDVALIDITY changed
+    with _message_cache_lock:
+        cache = _open_message_cache()
+        if cache is None:
+            return
+        stale = [
+            (key,) for key, in cache.execute("SELECT msg_key FROM messages WHERE folder = ?", (folder_key,))
+            if key not in live_keys
+        ]
+        if stale:
+            cache.executemany("DELETE FROM messages WHERE msg_key = ?", stale)
+            cache.commit()
+
+def close_message_cache():
+    global _message_cache
+    with _message_cache_lock:
+        if _message_cache is not None:
+            _message_cache.close()
+            _message_cache = None
+
+atexit.register(close_message_cache)
+
+def _logout_quietly(mail):
+    try:
+        mail.logout()
+    except (imaplib.IMAP4.error, OSError):
+        pass
+
+def _with_connection(imap_host, email_user, email_pass, folder, operation):
+    # Run operation(mail) on the pooled connection, reconnecting once if the session died
+    with _connection_lock(imap_host, email_user, folder):
+        for attempt in range(2):
+            mail = get_connection(imap_host, email_user, email_pass, folder)
+            try:
+                return operation(mail)
+            except (imaplib.IMAP4.abort, OSError):
+                drop_connection(imap_host, email_user, folder)
+                if attempt:
+                    raise
+
+def fetch_all_emails(imap_host, email_user, email_pass, folder="INBOX", full_body=False):
+    return _with_connection(
+        imap_host, email_user, email_pass, folder,
+        lambda mail: _fetch_all_emails(mail, folder, _cache_prefix(imap_host, email_user, folder), full_body)
+    )
 
-    emails = []
-    for eid in reversed(email_ids):
-        _, msg_data = mail.fetch(eid, "(RFC822)")
-        msg = email.message_from_bytes(msg_data[0][1])
-        emails.append(parse_email(msg, full_body=False))  # Use preview for listings
-    mail.logout()
-    return emails
+def fetch_folders(imap_host, email_user, email_pass, folders, full_body=False):
+    """Fetch several folders concurrently, one pooled connection per folder; returns {folder: emails}."""
+    folders = list(dict.fromkeys(folders))
+    if not folders:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(folders), MAX_FOLDER_CONNECTIONS)) as executor:
+        futures = {
+            folder: executor.submit(fetch_all_emails, imap_host, email_user, email_pass, folder, full_body)
+            for folder in folders
+        }
+        return {folder: future.result() for folder, future in futures.items()}
+
+def fetch_email(imap_host, email_user, email_pass, uid, folder="INBOX"):
+    """Fetch one complete message by UID, e.g. to show an email picked from a listing."""
+    return _with_connection(
+        imap_host, email_user, email_pass, folder,
+        lambda mail: _fetch_email(mail, _cache_prefix(imap_host, email_user, folder), uid, folder)
+    )
+
+def _cache_prefix(imap_host, email_user, folder):
+    return f"{email_user}@{imap_host}/{folder}/"
+
+def _select(mail, folder, cache_prefix, readonly=False):
+    # Select folder and return (key prefix of its messages, number of messages). UIDs
+    # are only unique within one folder and UIDVALIDITY, so both are part of the key.
+    status, data = mail.select(folder, readonly=readonly)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"Cannot select {folder}: {data[0].decode(errors='replace') if data and data[0] else status}")
+    exists = int(data[0])
+    _, data = mail.response("UIDVALIDITY")
+    validity = data[-1].decode() if data and data[-1] else ""
+    return f"{cache_prefix}{validity}/", exists
+
+def _fetch_all_emails(mail, folder, folder_key, full_body):
+    cache_prefix, exists = _select(mail, folder, folder_key)
+    if not exists:
+        _prune_messages(folder_key, set())
+        return []
+    # UIDs and INTERNALDATEs in one cheap round trip, newest first
+    dates = _internal_dates(mail, b"1:*")
+    email_uids = sorted(dates, key=int, reverse=True)
+    # A complete listing shows which cached messages were deleted or moved away
+    _prune_messages(folder_key, {f"{cache_prefix}{uid.decode()}/{date}" for uid, date in dates.items()})
+
+    # Use preview for listings unless the complete messages were asked for
+    return _fetch_cached(mail, cache_prefix, email_uids, dates, full_body=full_body)
+
+def _fetch_email(mail, cache_prefix, uid, folder):
+    cache_prefix, _ = _select(mail, folder, cache_prefix, readonly=True)
+    if isinstance(uid, str):
+        uid = uid.encode()
+    emails = _fetch_cached(mail, cache_prefix, [uid], _internal_dates(mail, uid), full_body=True)
+    if not emails:
+        raise ValueError(f"No message with UID {uid.decode()} in {folder}")
+    return emails[0]
+
+def _internal_dates(mail, uid_set):
+    # {uid: INTERNALDATE} for a UID set such as b"1:*"; callers skip empty folders,
+    # where some servers answer BAD to 1:*
+    status, data = mail.uid("FETCH", uid_set, "(FLAGS INTERNALDATE)")
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+    dates = {}
+    for item in data:
+        line = item[0] if isinstance(item, tuple) else item
+        if not isinstance(line, bytes):
+            continue
+        uid_match = _FETCH_UID.search(line)
+        date_match = _FETCH_INTERNALDATE.search(line)
+        if uid_match and date_match:
+            dates[uid_match.group(1)] = date_match.group(1).decode()
+    return dates
+
+def _fetch_cached(mail, cache_prefix, uids, dates, full_body=False):
+    # Serve complete messages from the local cache and FETCH only the rest. Complete
+    # messages that had to be downloaded are cached; previews are not, since they
+    # only hold the start of the body. Every message gets its "key" for the embedding cache.
+    keys = {uid: f"{cache_prefix}{uid.decode()}/{dates[uid]}" for uid in uids if uid in dates}
+    by_key = _load_cached_messages(list(keys.values()))
+    cached = {uid: by_key[key] for uid, key in keys.items() if key in by_key}
+
+    missing = [uid for uid in uids if uid not in cached]
+    fetched = {parsed["uid"].encode(): parsed for parsed in _fetch_many(mail, missing, full_body=full_body)}
+    for parsed in fetched.values():
+        parsed["key"] = cache_prefix + parsed["uid"]
+    if full_body and fetched:
+        # The folder is the key prefix without its UIDVALIDITY, which never contains "/"
+        folder_key = cache_prefix[:cache_prefix.rstrip("/").rfind("/") + 1]
+        _store_messages(folder_key, [(keys[uid], parsed) for uid, parsed in fetched.items() if uid in keys])
+
+    found = {**fetched, **cached}
+    return [found[uid] for uid in uids if uid in found]
+
+def _fetch_many(mail, uids, full_body=False):
+    # Fetch FETCH_CHUNK_SIZE messages per round trip and parse each chunk on a worker
+    # pool while the next chunk is downloading; results keep the order of uids
+    spec = FULL_FETCH if full_body else PREVIEW_FETCH
+    parse = _parse_full if full_body else _parse_preview
+    futures = {}
+    with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as executor:
+        for start in range(0, len(uids), FETCH_CHUNK_SIZE):
+            chunk = uids[start:start + FETCH_CHUNK_SIZE]
+            _, msg_data = mail.uid("FETCH", b",".join(chunk), spec)
+            for uid, sections in _split_fetch_response(msg_data):
+                futures[uid] = executor.submit(parse, uid, sections)
+        return [futures[uid].result() for uid in uids if uid in futures]
+
+def _split_fetch_response(msg_data):
+    # Group a multi-message FETCH response into (uid, {section: bytes}) pairs
+    uid, sections = None, {}
+    for item in msg_data:
+        prefix = item[0] if isinstance(item, tuple) else item
+        if not isinstance(prefix, bytes):
+            continue
+        if _FETCH_START.match(prefix):
+            if uid is not None and sections:
+                yield uid, sections
+            uid, sections = None, {}
+        uid_match = _FETCH_UID.search(prefix)
+        if uid_match:
+            uid = uid_match.group(1)
+        if isinstance(item, tuple):
+            section_match = _FETCH_SECTION.search(prefix)
+            if section_match:
+                sections[section_match.group(1).decode().upper()] = item[1]
+    if uid is not None and sections:
+        yield uid, sections
+
+def _parse_preview(uid, sections):
+    header = sections.get("HEADER", b"")
+    parsed = parse_headers_fast(header)
+    if sections.get("TEXT"):
+        parsed.update(parse_body_if_needed(header + sections["TEXT"]))
+    else:
+        parsed.update(body="", full_body="")
+    parsed["uid"] = uid.decode()
+    parsed["partial"] = True  # full_body only covers the first PREVIEW_FETCH_BYTES
+    return parsed
+
+def _parse_full(uid, sections):
+    msg_bytes = sections.get("", b"")
+    parsed = parse_headers_fast(msg_bytes)
+    parsed.update(parse_body_if_needed(msg_bytes))
+    parsed["uid"] = uid.decode()
+    return parsed
 
 def search_emails(imap_host, email_user, email_pass, keyword, folder="INBOX"):
-    mail = login_to_email(imap_host, email_user, email_pass)
-    mail.select(folder)
-    _, data = mail.search(None, "ALL")
-    email_ids = data[0].split()
+    return _with_connection(
+        imap_host, email_user, email_pass, folder,
+        lambda mail: _search_emails(mail, _cache_prefix(imap_host, email_user, folder), keyword, folder)
+    )
+
+def _server_search(mail, keyword):
+    # Let the server narrow the candidates with SEARCH TEXT (headers + body);
+    # returns None when the server rejects the query
+    if not keyword:
+        return None
+    try:
+        if keyword.isascii() and keyword.isprintable():
+            quoted = '"' + keyword.replace("\\", "\\\\").replace('"', '\\"') + '"'
+            status, data = mail.uid("SEARCH", None, "TEXT", quoted)
+        else:
+            # Non-ASCII keywords are sent as a UTF-8 literal
+            mail.literal = keyword.encode("utf-8")
+            status, data = mail.uid("SEARCH", "CHARSET", "UTF-8", "TEXT")
+    except imaplib.IMAP4.error as e:
+        if isinstance(e, imaplib.IMAP4.abort):
+            raise
+        return None
+    if status != "OK":
+        return None
+    return data[0].split()
+
+def _search_emails(mail, cache_prefix, keyword, folder):
+    cache_prefix, exists = _select(mail, folder, cache_prefix)
+    if not exists:
+        return []
+    email_uids = _server_search(mail, keyword)
+    if email_uids is None:
+        # Fall back to scanning every message locally
+        dates = _internal_dates(mail, b"1:*")
+        email_uids = sorted(dates, key=int)
+    else:
+        dates = {}
+        for start in range(0, len(email_uids), FETCH_CHUNK_SIZE):
+            dates.update(_internal_dates(mail, b",".join(email_uids[start:start + FETCH_CHUNK_SIZE])))
+
+    # Case-insensitive match in C, without lowercased copies of every body
+    pattern = re.compile(re.escape(keyword), re.IGNORECASE)
 
     result = []
-    for eid in reversed(email_ids):
-        _, msg_data = mail.fetch(eid, "(RFC822)")
-        msg = email.message_from_bytes(msg_data[0][1])
-        parsed = parse_email(msg, full_body=False)  # Use preview for search
-        # Search in full body content for better results
-        if (keyword.lower() in parsed["subject"].lower()
-            or keyword.lower() in parsed["full_body"].lower()
-            or keyword.lower() in parsed["from"].lower()
-            or keyword.lower() in parsed["date"].lower()):
+    # Match against the complete body; only messages not seen before are downloaded
+    for parsed in _fetch_cached(mail, cache_prefix, list(reversed(email_uids)), dates, full_body=True):
+        # Confirm the match locally so results are the same with or without server search
+        if (pattern.search(parsed["subject"])
+            or pattern.search(parsed["full_body"])
+            or pattern.search(parsed["from"])
+            or pattern.search(parsed["date"])):
                     result.append(parsed)
-    mail.logout()
     return result
 
+def parse_headers_fast(msg_bytes):
+    """Parse Subject/From/Date without touching the body; the default policy decodes RFC 2047 words."""
+    headers = _HEADER_PARSER.parsebytes(msg_bytes)
+    return {
+        "subject": _header_text(headers, "Subject") or "(No Subject)",
+        "from": _header_text(headers, "From"),
+        "date": _header_text(headers, "Date"),
+    }
+
+def _header_text(headers, name):
+    value = headers.get(name)
+    return str(value) if value is not None else ""
+
+def parse_body_if_needed(msg_bytes, full_body=False):
+    """Decode the first text/plain part; only called when the body has been fetched."""
+    return _parse_body(email.message_from_bytes(msg_bytes), full_body)
+
 def parse_email(msg, full_body=False):
     subject, encoding = decode_header(msg.get("Subject"))[0]
     if isinstance(subject, bytes):
         subject = subject.decode(encoding or "utf-8", errors="ignore")
 
-    from_ = msg.get("From")
-    date_ = msg.get("Date")
+    parsed = {
+        "subject": subject or "(No Subject)",
+        "from": msg.get("From"),
+        "date": msg.get("Date"),
+    }
+    parsed.update(_parse_body(msg, full_body))
+    return parsed
+
+def _parse_body(msg, full_body):
     body = ""
 
     if msg.is_multipart():
@@ -65,9 +516,6 @@ def parse_email(msg, full_body=False):
     preview_body = full_body_content[:200] if not full_body else full_body_content
 
     return {
-        "subject": subject or "(No Subject)",
-        "from": from_,
-        "date": date_,
         "body": preview_body,
         "full_body": full_body_content  # Always store full content
     }
@@ -6,29 +6,180 @@ Uses sentence-transformers with all-MiniLM-L6-v2 model for local processing.
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
+import importlib.util
+import os
+import platform
 import warnings
 import re
 import html
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Locks the shared corpus files against other processes (the CLI and web workers)
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
 
 # Suppress warnings for cleaner output
 warnings.filterwarnings("ignore")
 
+# The ONNX backend of sentence-transformers needs optimum and onnxruntime installed
+_HAS_ONNX = all(importlib.util.find_spec(name) is not None for name in ("optimum", "onnxruntime"))
+
+# Pre-quantized int8 ONNX exports shipped in the sentence-transformers model repos
+if platform.machine().lower() in ("arm64", "aarch64"):
+    ONNX_INT8_FILE = "onnx/model_qint8_arm64.onnx"
+else:
+    ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+# Optional C HTML parser for turning HTML bodies into plain text
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        # selectolax < 1.0 only ships the Modest backend
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+# Elements whose contents never count as email text
+_HTML_DROP_TAGS = ['script', 'style', 'head', 'blockquote']
+
+# Precompiled patterns used by clean_email_body
+_HTML_TAG = re.compile(r'<[^>]+>')
+_QUOTED_LINE = re.compile(r'(?m)^[ \t]*>.*$')
+_URL = re.compile(r'https?://\S+')
+_EMAIL = re.compile(r'\b[\w.%+-]+@[\w.-]+\.[A-Za-z]{2,}\b')
+_WS = re.compile(r'\s+')
+_FOOTER = re.compile(r'(?:unsubscribe|privacy policy|terms of service|\bsent from\b|\bbest regards\b|\bsincerely\b).*', re.IGNORECASE | re.DOTALL)
+_SPECIAL = re.compile(r'[^\w\s.,!?;:\-\'"()]')
+
+# Share of an email embedding taken by the subject; the cleaned body gets the rest
+SUBJECT_WEIGHT = 0.4
+
+# Bumped whenever the way email embeddings are built changes, so cached vectors are rebuilt
+EMBEDDING_SCHEME = f"subject-{SUBJECT_WEIGHT}"
+
+# Default location of the memory-mapped corpus files
+DEFAULT_CORPUS_DIR = os.path.join(os.path.expanduser('~'), '.mail-cli')
+
+# Row index stored next to the corpus matrix: email key (UTF-8, sized to the longest) and content digest per row
+def _corpus_index_dtype(key_bytes):
+    return np.dtype([('key', f'S{max(1, key_bytes)}'), ('digest', np.uint8, (20,))])
+
+# Rows of the int8 corpus dequantized per BLAS call; keeps the float32 block cache-resident
+_SIMILARITY_BLOCK_ROWS = 1024
+
+
+def quantize_int8(x):
+    """
+    Quantize embeddings to int8 with a per-vector scale.
+    
+    Args:
+        x (np.ndarray): Embedding vector or (N, D) matrix of embeddings
+        
+    Returns:
+        tuple: (int8 array shaped like x, float32 scale per vector) such that
+            x is approximately quantized * scale
+    """
+    x = np.asarray(x, dtype=np.float32)
+    max_abs = np.max(np.abs(x), axis=-1, keepdims=True)
+    max_abs[max_abs == 0] = 1.0
+    quantized = np.rint(x * (127.0 / max_abs)).astype(np.int8)
+    scale = (max_abs / 127.0).astype(np.float32)
+    return quantized, np.squeeze(scale, axis=-1)
+
+
 class SemanticSearchEngine:
-    def __init__(self, model_name='all-mpnet-base-v2', similarity_threshold=0.1):
+    # Queries at least this similar to a cached query reuse its results
+    query_cache_threshold = 0.95
+    query_cache_size = 128
+    
+    def __init__(self, model_name='all-mpnet-base-v2', similarity_threshold=0.1, cache_path='embeddings.sqlite', batch_size=32, backend='auto', corpus_dir=DEFAULT_CORPUS_DIR):
         """
         Initialize the semantic search engine with a local embedding model.
         
         Args:
             model_name (str): Name of the sentence-transformers model to use
             similarity_threshold (float): Minimum similarity score to include in results
+            cache_path (str): Path of the sqlite file used to persist email embeddings
+            batch_size (int): Number of texts encoded per model forward pass
+            backend (str): 'onnx' for the int8 ONNX Runtime model, 'torch' for PyTorch,
+                or 'auto' to use ONNX when optimum and onnxruntime are installed
+            corpus_dir (str): Directory holding the memory-mapped corpus matrix, or None
+                to keep the corpus in memory only
         """
         try:
-            self.model = SentenceTransformer(model_name)
+            self.model, self.backend = self._load_model(model_name, backend)
             self.model_name = model_name
         except Exception:
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.model, self.backend = self._load_model('all-MiniLM-L6-v2', backend)
             self.model_name = 'all-MiniLM-L6-v2'
         self.similarity_threshold = similarity_threshold
+        self.batch_size = batch_size
+        
+        # Guards the sqlite cache and the in-memory corpus
+        self._lock = threading.RLock()
+        
+        # Persistent embedding cache keyed by the email 'key' (account, folder, UIDVALIDITY
+        # and UID, see imap_client); the body hash detects changed messages. Vectors from
+        # different backends or embedding schemes differ, so both are part of the key.
+        self.cache_path = cache_path
+        self._cache_model = f"{self.model_name}:{self.backend}:{EMBEDDING_SCHEME}"
+        self._cache = sqlite3.connect(cache_path, check_same_thread=False)
+        self._cache.execute(
+            "CREATE TABLE IF NOT EXISTS email_embeddings "
+            "(email_key TEXT, model TEXT, body_sha1 BLOB, dim INT, vec BLOB, PRIMARY KEY (email_key, model))"
+        )
+        self._cache.commit()
+        
+        # In-memory corpus: one contiguous int8 matrix (with per-row scales) grown in place,
+        # plus its row index
+        self._corpus_version = 0
+        self._reset_corpus()
+        
+        # Back the corpus with memory-mapped files so warm starts skip the sqlite reload.
+        # Other processes may share the files; the lock file serialises their writes and
+        # the row index signature tells when another process has added rows.
+        self.corpus_dir = corpus_dir
+        self._corpus_lock_file = None
+        self._corpus_signature = None
+        if corpus_dir:
+            with self._corpus_file_lock():
+                self._refresh_corpus_files()
+        
+        # Recent query results: sha1(query) -> (query embedding, context, ranked results)
+        self._query_cache = OrderedDict()
+    
+    def _load_model(self, model_name, backend):
+        """
+        Load the embedding model, preferring the int8 ONNX Runtime backend.
+        
+        Args:
+            model_name (str): Name of the sentence-transformers model to use
+            backend (str): 'auto', 'onnx' or 'torch'
+            
+        Returns:
+            tuple: (SentenceTransformer model, name of the backend in use)
+        """
+        if backend == 'onnx' or (backend == 'auto' and _HAS_ONNX):
+            try:
+                model = SentenceTransformer(
+                    model_name,
+                    backend='onnx',
+                    model_kwargs={'file_name': ONNX_INT8_FILE}
+                )
+                return model, 'onnx-int8'
+            except Exception:
+                if backend == 'onnx':
+                    raise
+        return SentenceTransformer(model_name), 'torch'
     
     def clean_email_body(self, body):
         """
@@ -46,41 +197,128 @@ class SemanticSearchEngine:
         # Convert to string if not already
         text = str(body)
         
-        # Decode HTML entities
-        text = html.unescape(text)
-        
-        # Remove HTML tags
-        text = re.sub(r'<[^>]+>', ' ', text)
+        if HTMLParser is not None and '<' in text:
+            # Extract visible text in one C pass; drops script/style contents and
+            # quoted replies, and decodes HTML entities
+            tree = HTMLParser(text)
+            tree.strip_tags(_HTML_DROP_TAGS)
+            text = tree.text(separator=' ')
+        else:
+            # Decode HTML entities
+            text = html.unescape(text)
+            
+            # Remove HTML tags
+            text = _HTML_TAG.sub(' ', text)
         
-        # Remove URLs
-        text = re.sub(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', ' ', text)
+        # Remove quoted text (lines starting with >) while line breaks are still present
+        text = _QUOTED_LINE.sub('', text)
         
-        # Remove email addresses
-        text = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', ' ', text)
+        # Remove URLs and email addresses
+        text = _URL.sub(' ', text)
+        text = _EMAIL.sub(' ', text)
         
         # Remove excessive whitespace and line breaks
-        text = re.sub(r'\s+', ' ', text)
+        text = _WS.sub(' ', text)
         
         # Remove common email footers and signatures
-        text = re.sub(r'(unsubscribe|privacy policy|terms of service|\bsent from\b|\bbest regards\b|\bsincerely\b).*', '', text, flags=re.IGNORECASE)
+        text = _FOOTER.sub('', text)
         
-        # Remove quoted text (lines starting with >)
-        lines = text.split('\n')
-        cleaned_lines = [line for line in lines if not line.strip().startswith('>')]
-        text = ' '.join(cleaned_lines)
+        # Limit length to avoid very long embeddings (keep first 500 characters)
+        truncated = len(text) > 500
+        text = text[:500]
         
         # Remove special characters but keep basic punctuation
-        text = re.sub(r'[^\w\s.,!?;:\-\'"()]', ' ', text)
+        text = _SPECIAL.sub(' ', text)
         
         # Final cleanup: remove extra spaces and trim
-        text = re.sub(r'\s+', ' ', text).strip()
+        text = _WS.sub(' ', text).strip()
         
-        # Limit length to avoid very long embeddings (keep first 500 characters)
-        if len(text) > 500:
-            text = text[:500] + "..."
+        if truncated:
+            text += "..."
         
         return text
     
+    def clean_email_bodies(self, bodies):
+        """
+        Clean a batch of email body contents.
+        
+        Each distinct body is cleaned once; this only saves work when bodies are
+        byte-identical (repeated newsletters or notifications).
+        
+        Args:
+            bodies (list): Raw email body contents
+            
+        Returns:
+            list: Cleaned email bodies, in the same order
+        """
+        cleaned = {}
+        clean = self.clean_email_body
+        for body in bodies:
+            if body not in cleaned:
+                cleaned[body] = clean(body)
+        return [cleaned[body] for body in bodies]
+    
+    def encode_texts(self, texts):
+        """
+        Encode a list of texts in batches.
+        
+        Args:
+            texts (list): List of texts to encode
+            
+        Returns:
+            np.ndarray: (N, D) matrix of normalized float32 embeddings
+        """
+        embeddings = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return embeddings.astype(np.float32, copy=False)
+    
+    def embed_emails(self, emails):
+        """
+        Create embeddings for emails by combining separately encoded subjects and bodies.
+        
+        Subjects and bodies are encoded in two batched calls and mixed with
+        SUBJECT_WEIGHT, so the subject no longer has to be repeated inside the
+        token window to carry extra weight.
+        
+        Args:
+            emails (list): List of email dictionaries
+            
+        Returns:
+            np.ndarray: (N, D) matrix of normalized float32 embeddings
+        """
+        # Get the subject and the cleaned body (full_body if available, otherwise body)
+        subjects = [email.get('subject', '').strip() for email in emails]
+        bodies = self.clean_email_bodies([email.get('full_body', email.get('body', '')) for email in emails])
+        texts = list(zip(subjects, bodies))
+        with_subject = [i for i, (subject, _) in enumerate(texts) if subject]
+        with_body = [i for i, (_, body) in enumerate(texts) if body]
+        # Handle empty content
+        empty = [i for i, (subject, body) in enumerate(texts) if not subject and not body]
+        
+        parts = []
+        if with_subject:
+            parts.append((with_subject, [texts[i][0] for i in with_subject], SUBJECT_WEIGHT))
+        if with_body:
+            parts.append((with_body, [texts[i][1] for i in with_body], 1.0 - SUBJECT_WEIGHT))
+        if empty:
+            parts.append((empty, ["empty email"] * len(empty), 1.0))
+        
+        embeddings = None
+        for indices, part_texts, weight in parts:
+            encoded = self.encode_texts(part_texts)
+            if embeddings is None:
+                embeddings = np.zeros((len(emails), encoded.shape[1]), dtype=np.float32)
+            embeddings[indices] += weight * encoded
+        
+        # Normalize the weighted sum so dot products stay cosine similarities
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+    
     def create_email_embedding(self, email_data):
         """
         Create an embedding for an email by combining subject and body.
@@ -91,24 +329,339 @@ class SemanticSearchEngine:
         Returns:
             np.ndarray: Normalized embedding vector
         """
-        # Get and clean subject and body
-        subject = email_data.get('subject', '').strip()
-        # Use full_body if available, otherwise fall back to body
+        return self.embed_emails([email_data])[0]
+    
+    def email_digest(self, email_data):
+        """
+        Hash the email content that feeds into its embedding.
+        
+        Args:
+            email_data (dict): Email data with 'subject' and 'body' keys
+            
+        Returns:
+            bytes: SHA-1 digest of the subject and body
+        """
+        subject = email_data.get('subject', '')
         body = email_data.get('full_body', email_data.get('body', ''))
+        return hashlib.sha1(f"{subject}\0{body}".encode('utf-8', errors='ignore')).digest()
+    
+    def index_emails(self, emails):
+        """
+        Make sure every email has an up-to-date row in the in-memory corpus matrix.
+        
+        Emails already in the corpus are reused as-is. The rest are looked up in the
+        sqlite cache by 'key', and only new or changed emails are encoded; their
+        vectors are written back to the cache. Emails without a 'key' are keyed by
+        their content hash and are not persisted.
+        
+        Args:
+            emails (list): List of email dictionaries
+            
+        Returns:
+            np.ndarray: Corpus row index for each email
+        """
+        digests = [self.email_digest(email) for email in emails]
+        email_keys = [email.get('key') for email in emails]
+        keys = [key or f"sha1:{digest.hex()}" for key, digest in zip(email_keys, digests)]
+        rows = np.empty(len(emails), dtype=np.intp)
+        
+        with self._lock, self._corpus_file_lock():
+            # Rows appended by other processes sharing the corpus files
+            if self.corpus_dir:
+                self._refresh_corpus_files()
+            
+            pending = []
+            for i, key in enumerate(keys):
+                row = self._corpus_index.get(key)
+                if row is not None and self._corpus_digests[row] == digests[i]:
+                    rows[i] = row
+                else:
+                    pending.append(i)
+            
+            if not pending:
+                return rows
+            
+            cached = self._load_cached_embeddings([email_keys[i] for i in pending if email_keys[i]])
+            misses = []
+            for i in pending:
+                hit = cached.get(email_keys[i]) if email_keys[i] else None
+                if hit is not None and hit[0] == digests[i]:
+                    rows[i] = self._store_in_corpus(keys[i], digests[i], hit[1])
+                else:
+                    misses.append(i)
+            
+            # Only run the model on emails that are not cached yet, in a single batched call
+            if misses:
+                new_embeddings = self.embed_emails([emails[i] for i in misses])
+                cache_rows = []
+                for i, embedding in zip(misses, new_embeddings):
+                    rows[i] = self._store_in_corpus(keys[i], digests[i], embedding)
+                    if email_keys[i]:
+                        cache_rows.append((email_keys[i], self._cache_model, digests[i], embedding.shape[0], embedding.tobytes()))
+                
+                if cache_rows:
+                    self._cache.executemany(
+                        "INSERT OR REPLACE INTO email_embeddings (email_key, model, body_sha1, dim, vec) VALUES (?, ?, ?, ?, ?)",
+                        cache_rows
+                    )
+                    self._cache.commit()
+            
+            self._save_corpus_files()
         
-        # Clean the email body
-        cleaned_body = self.clean_email_body(body)
+        return rows
+    
+    def get_email_embeddings(self, emails):
+        """
+        Get embeddings for a list of emails, reusing cached vectors where possible.
         
-        # Create combined text with weighted subject
-        combined_text = f"{subject} {subject} {cleaned_body}"
+        Args:
+            emails (list): List of email dictionaries
+            
+        Returns:
+            np.ndarray: (N, D) matrix of normalized float32 embeddings, one row per email
+        """
+        rows = self.index_emails(emails)
+        with self._lock:
+            return self._dequantize_rows(rows)
+    
+    def _dequantize_rows(self, rows):
+        """
+        Reconstruct float32 embeddings from the int8 corpus.
         
-        # Handle empty content
-        if not combined_text.strip():
-            combined_text = "empty email"
+        Args:
+            rows (np.ndarray or slice): Corpus rows to reconstruct
+            
+        Returns:
+            np.ndarray: Float32 embeddings for the selected rows
+        """
+        return self._corpus_int8[rows].astype(np.float32) * self._corpus_scale[rows, None]
+    
+    def _store_in_corpus(self, key, digest, embedding):
+        """
+        Write an embedding into the corpus matrix, growing it when full.
+        
+        Args:
+            key (str): Email key, or content-hash key for emails without one
+            digest (bytes): Content digest of the email
+            embedding (np.ndarray): Normalized embedding vector
+            
+        Returns:
+            int: Corpus row holding the embedding
+        """
+        row = self._corpus_index.get(key)
+        if row is None:
+            row = self._corpus_size
+            if row >= self._corpus_int8.shape[0]:
+                # Grow geometrically so appends stay amortized O(1)
+                self._grow_corpus(max(64, 2 * self._corpus_int8.shape[0]), embedding.shape[0])
+            self._corpus_size += 1
+            self._corpus_keys.append(key)
+            self._corpus_digests.append(digest)
+            self._corpus_index[key] = row
+        else:
+            self._corpus_digests[row] = digest
+        
+        self._corpus_int8[row], self._corpus_scale[row] = quantize_int8(embedding)
+        self._corpus_version += 1
+        return row
+    
+    def _grow_corpus(self, capacity, dim):
+        """
+        Resize the corpus matrix to hold `capacity` rows, keeping existing rows.
+        
+        Args:
+            capacity (int): New number of rows
+            dim (int): Embedding dimension
+        """
+        n = self._corpus_size
+        if self.corpus_dir:
+            # Extend the backing files and remap them; existing rows stay on disk
+            for arr in (self._corpus_int8, self._corpus_scale):
+                if isinstance(arr, np.memmap):
+                    arr.flush()
+            self._corpus_int8 = self._corpus_scale = None
+            data_path, scale_path, _ = self._corpus_paths()
+            with open(data_path, 'ab') as f:
+                f.truncate(capacity * dim)
+            with open(scale_path, 'ab') as f:
+                f.truncate(capacity * 4)
+            self._corpus_int8 = np.memmap(data_path, dtype=np.int8, mode='r+', shape=(capacity, dim))
+            self._corpus_scale = np.memmap(scale_path, dtype=np.float32, mode='r+', shape=(capacity,))
+            return
+        
+        grown = np.empty((capacity, dim), dtype=np.int8)
+        grown_scale = np.empty(capacity, dtype=np.float32)
+        if n:
+            grown[:n] = self._corpus_int8[:n]
+            grown_scale[:n] = self._corpus_scale[:n]
+        self._corpus_int8 = grown
+        self._corpus_scale = grown_scale
+    
+    def _corpus_paths(self):
+        """
+        Get the file paths of the memory-mapped corpus for the current model.
         
-        # Generate embedding
-        embedding = self.model.encode(combined_text, convert_to_tensor=False)
-        return embedding / np.linalg.norm(embedding)  # Return normalized embedding
+        Returns:
+            tuple: (int8 matrix path, scale vector path, row index path)
+        """
+        name = re.sub(r'[^\w.-]', '_', self._cache_model)
+        base = os.path.join(self.corpus_dir, f"emb_{name}")
+        return f"{base}.dat", f"{base}.scale.dat", f"{base}.uids.npy"
+    
+    def _reset_corpus(self):
+        """
+        Start an empty corpus.
+        """
+        self._corpus_int8 = np.empty((0, 0), dtype=np.int8)
+        self._corpus_scale = np.empty(0, dtype=np.float32)
+        self._corpus_size = 0
+        self._corpus_keys = []
+        self._corpus_digests = []
+        self._corpus_index = {}
+        self._corpus_version += 1
+    
+    @contextmanager
+    def _corpus_file_lock(self):
+        """
+        Hold an exclusive lock on the corpus files, shared with other processes.
+        """
+        if not self.corpus_dir:
+            yield
+            return
+        
+        data_path, _, _ = self._corpus_paths()
+        lock_path = data_path[:-len('.dat')] + '.lock'
+        while True:
+            if self._corpus_lock_file is None:
+                # The directory may have been deleted while the engine was running; it sits
+                # next to the message cache, which holds complete mail bodies
+                os.makedirs(self.corpus_dir, mode=0o700, exist_ok=True)
+                self._corpus_lock_file = open(lock_path, 'a+b')
+            fd = self._corpus_lock_file.fileno()
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                self._corpus_lock_file.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            
+            # A lock on a file that has since been removed or replaced excludes nobody
+            # that opens the new one: reopen it and lock again
+            try:
+                if os.path.samestat(os.fstat(fd), os.stat(lock_path)):
+                    break
+            except FileNotFoundError:
+                pass
+            if fcntl is None:
+                self._corpus_lock_file.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            self._corpus_lock_file.close()
+            self._corpus_lock_file = None
+        
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                self._corpus_lock_file.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    
+    def _refresh_corpus_files(self):
+        """
+        Map the on-disk corpus into memory if its row index changed since it was last
+        read or written here, e.g. by another process. Must be called with the corpus
+        file lock held.
+        
+        Rows are only ever appended or rewritten for the same key, so rows that are
+        already known keep their position.
+        """
+        data_path, scale_path, index_path = self._corpus_paths()
+        try:
+            stat = os.stat(index_path)
+        except FileNotFoundError:
+            if self._corpus_signature is not None:
+                # The files were removed (e.g. rebuilt by another process): start over
+                self._corpus_signature = None
+                self._reset_corpus()
+            return
+        
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._corpus_signature:
+            return
+        
+        try:
+            capacity = os.path.getsize(scale_path) // 4
+            dim = os.path.getsize(data_path) // capacity
+            index = np.load(index_path)
+            if len(index) > capacity or capacity * dim != os.path.getsize(data_path):
+                raise ValueError("corpus files do not match")
+            keys = [key.decode('utf-8') for key in index['key']]
+        except (OSError, ValueError, ZeroDivisionError, UnicodeDecodeError):
+            # Unreadable or inconsistent files: rebuild the corpus from the sqlite cache
+            for path in (data_path, scale_path, index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._corpus_signature = None
+            self._reset_corpus()
+            return
+        
+        if not isinstance(self._corpus_int8, np.memmap) or self._corpus_int8.shape != (capacity, dim):
+            self._corpus_int8 = np.memmap(data_path, dtype=np.int8, mode='r+', shape=(capacity, dim))
+            self._corpus_scale = np.memmap(scale_path, dtype=np.float32, mode='r+', shape=(capacity,))
+        self._corpus_size = len(index)
+        self._corpus_keys = keys
+        self._corpus_digests = [digest.tobytes() for digest in index['digest']]
+        self._corpus_index = {key: row for row, key in enumerate(keys)}
+        self._corpus_signature = signature
+        self._corpus_version += 1
+    
+    def _save_corpus_files(self):
+        """
+        Flush the memory-mapped corpus and write its row index next to it.
+        """
+        if not self.corpus_dir or self._corpus_size == 0:
+            return
+        
+        self._corpus_int8.flush()
+        self._corpus_scale.flush()
+        
+        encoded_keys = [key.encode('utf-8') for key in self._corpus_keys]
+        index = np.empty(self._corpus_size, dtype=_corpus_index_dtype(max(map(len, encoded_keys))))
+        index['key'] = encoded_keys
+        index['digest'] = np.frombuffer(b''.join(self._corpus_digests), dtype=np.uint8).reshape(-1, 20)
+        
+        # Write the index last and atomically, so it never lists rows that are not on disk
+        _, _, index_path = self._corpus_paths()
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, index)
+        os.replace(tmp_path, index_path)
+        stat = os.stat(index_path)
+        self._corpus_signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    
+    def _load_cached_embeddings(self, keys, chunk_size=500):
+        """
+        Load cached embeddings for the given email keys and the current model.
+        
+        Args:
+            keys (list): List of email keys
+            chunk_size (int): Number of keys per SELECT (sqlite limits bound parameters)
+            
+        Returns:
+            dict: Mapping of key to (body_sha1, embedding)
+        """
+        cached = {}
+        with self._lock:
+            for start in range(0, len(keys), chunk_size):
+                chunk = keys[start:start + chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self._cache.execute(
+                    f"SELECT email_key, body_sha1, vec FROM email_embeddings WHERE model = ? AND email_key IN ({placeholders})",
+                    [self._cache_model, *chunk]
+                )
+                for key, body_sha1, vec in cursor:
+                    cached[key] = (body_sha1, np.frombuffer(vec, dtype=np.float32))
+        return cached
     
     def create_query_embedding(self, query):
         """
@@ -120,31 +673,57 @@ class SemanticSearchEngine:
         Returns:
             np.ndarray: Normalized embedding vector
         """
-        embedding = self.model.encode(query, convert_to_tensor=False)
-        return embedding / np.linalg.norm(embedding)  # Return normalized embedding
+        return self.encode_texts([query])[0]
     
-    def compute_similarity(self, query_embedding, email_embeddings):
+    def compute_similarity(self, query_embedding, email_embeddings=None):
         """
         Compute cosine similarity between query and email embeddings.
         
         Args:
             query_embedding (np.ndarray): Query embedding vector
-            email_embeddings (list): List of email embedding vectors
+            email_embeddings (np.ndarray): (N, D) matrix of email embeddings;
+                defaults to the whole in-memory int8 corpus
             
         Returns:
             np.ndarray: Similarity scores
         """
-        if not email_embeddings:
-            return np.array([])
+        query_embedding = query_embedding.astype(np.float32, copy=False)
         
-        # Stack email embeddings into matrix
-        email_matrix = np.vstack(email_embeddings)
+        if email_embeddings is None:
+            return self._corpus_similarity(query_embedding)
+        
+        if len(email_embeddings) == 0:
+            return np.array([])
         
         # Compute cosine similarity (both embeddings are already normalized)
-        similarities = np.dot(email_matrix, query_embedding)
+        similarities = email_embeddings @ query_embedding
         
         return similarities
     
+    def _corpus_similarity(self, query_embedding, rows=None):
+        """
+        Score the query against rows of the int8 corpus.
+        
+        Blocks of int8 rows are widened to float32 and multiplied with the query in
+        one BLAS call each, then rescaled by the per-row quantization scale.
+        
+        Args:
+            query_embedding (np.ndarray): Normalized float32 query embedding
+            rows (np.ndarray): Corpus rows to score; defaults to every row
+            
+        Returns:
+            np.ndarray: Similarity score for each selected row
+        """
+        if rows is None:
+            rows = np.arange(self._corpus_size)
+        similarities = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _SIMILARITY_BLOCK_ROWS):
+            block_rows = rows[start:start + _SIMILARITY_BLOCK_ROWS]
+            block = self._corpus_int8[block_rows].astype(np.float32)
+            np.matmul(block, query_embedding, out=similarities[start:start + len(block_rows)])
+        similarities *= self._corpus_scale[rows]
+        return similarities
+    
     def semantic_search(self, query, emails, top_k=5, min_threshold=None):
         """
         Perform semantic search on a list of emails.
@@ -164,31 +743,110 @@ class SemanticSearchEngine:
         # Use provided threshold or default
         threshold = min_threshold if min_threshold is not None else self.similarity_threshold
         
+        # Make sure all emails are in the corpus (cached ones are not recomputed)
+        rows = self.index_emails(emails)
+        
+        with self._lock:
+            # Cached results are only valid for the same emails, corpus contents and parameters
+            context = (hashlib.sha1(rows.tobytes()).digest(), self._corpus_version, threshold, top_k)
+            query_key = hashlib.sha1(query.encode('utf-8')).digest()
+            
+            entry = self._query_cache.get(query_key)
+            if entry is not None:
+                self._query_cache.move_to_end(query_key)
+                if entry[1] == context:
+                    return [(emails[i], score) for i, score in entry[2]]
+                query_embedding = entry[0]
+            else:
+                query_embedding = None
+        
         # Create query embedding
-        query_embedding = self.create_query_embedding(query)
+        if query_embedding is None:
+            query_embedding = self.create_query_embedding(query)
         
-        # Create embeddings for all emails
-        email_embeddings = [self.create_email_embedding(email) for email in emails]
+        with self._lock:
+            # Reuse the results of a near-identical earlier query
+            ranked = self._similar_cached_query(query_embedding, context)
+            
+            if ranked is None:
+                # Only score the rows of these emails; the corpus also holds other folders and accounts
+                similarities = self._corpus_similarity(query_embedding.astype(np.float32, copy=False), rows)
+                ranked = self._rank(similarities, threshold, top_k)
+            
+            self._query_cache[query_key] = (query_embedding, context, ranked)
+            self._query_cache.move_to_end(query_key)
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
         
-        # Compute similarities
-        similarities = self.compute_similarity(query_embedding, email_embeddings)
+        return [(emails[i], score) for i, score in ranked]
+    
+    def _similar_cached_query(self, query_embedding, context):
+        """
+        Find cached results for a query whose embedding is close to this one.
         
-        # Combine emails with their similarity scores
-        email_scores = list(zip(emails, similarities))
+        Args:
+            query_embedding (np.ndarray): Normalized query embedding
+            context (tuple): Emails, corpus version and parameters the results must match
+            
+        Returns:
+            list or None: Cached (position, score) results, or None if no cached query
+                reaches query_cache_threshold
+        """
+        candidates = [entry for entry in self._query_cache.values() if entry[1] == context]
+        if not candidates:
+            return None
+        
+        cached_queries = np.vstack([entry[0] for entry in candidates])
+        similarities = cached_queries @ query_embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.query_cache_threshold:
+            return candidates[best][2]
+        return None
+    
+    def _rank(self, similarities, threshold, top_k):
+        """
+        Rank email positions by similarity score.
         
-        # Filter by similarity threshold
-        filtered_scores = [(email, score) for email, score in email_scores if score >= threshold]
+        Args:
+            similarities (np.ndarray): Similarity score for each email
+            threshold (float): Minimum similarity threshold
+            top_k (int): Number of top results to return
+            
+        Returns:
+            list: List of tuples (email position, similarity_score) sorted by relevance
+        """
+        # Positions of emails above the similarity threshold
+        candidates = np.flatnonzero(similarities >= threshold)
         
-        if not filtered_scores:
+        if len(candidates) == 0:
             # Return top result anyway if no matches above threshold
-            email_scores.sort(key=lambda x: x[1], reverse=True)
-            return email_scores[:1] if email_scores else []
+            best = int(np.argmax(similarities))
+            return [(best, float(similarities[best]))]
         
-        # Sort by similarity score (descending)
-        filtered_scores.sort(key=lambda x: x[1], reverse=True)
+        # Select the top-k in O(N), then sort only those by similarity score (descending)
+        scores = similarities[candidates]
+        if len(candidates) > top_k:
+            top = np.argpartition(-scores, top_k)[:top_k]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
         
-        # Return top-k results
-        return filtered_scores[:top_k]
+        return [(int(i), float(score)) for i, score in zip(candidates[order], scores[order])]
+    
+    def rank(self, query, emails):
+        """
+        Rank all emails by similarity to a query, without threshold filtering.
+        
+        Use filter_ranked on the result to try different thresholds without
+        scoring the emails again.
+        
+        Args:
+            query (str): Search query
+            emails (list): List of email dictionaries
+            
+        Returns:
+            list: List of tuples (email, similarity_score) for every email, sorted by relevance
+        """
+        return self.semantic_search(query, emails, top_k=len(emails), min_threshold=-np.inf)
     
     def search_with_threshold(self, query, emails, threshold=0.3, top_k=10):
         """
@@ -212,6 +870,23 @@ class SemanticSearchEngine:
         return filtered_results[:top_k]
 
 
+def filter_ranked(ranked, threshold, top_k=5):
+    """
+    Apply a similarity threshold to results from SemanticSearchEngine.rank.
+    
+    Args:
+        ranked (list): List of tuples (email, similarity_score) sorted by relevance
+        threshold (float): Minimum similarity threshold
+        top_k (int): Number of top results to return
+        
+    Returns:
+        list: Top-k results above the threshold, or the best result if none pass,
+            matching semantic_search
+    """
+    filtered = [(email, score) for email, score in ranked if score >= threshold]
+    return filtered[:top_k] if filtered else ranked[:1]
+
+
 # Global instance to avoid reloading model
 _semantic_engine = None
 
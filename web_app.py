@@ -1,9 +1,31 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 
-from imap_client import fetch_all_emails, search_emails
+from imap_client import fetch_all_emails, fetch_folders, search_emails
 from semantic_search import semantic_search_emails, semantic_search_with_scores
 import os
+
+# Optional C JSON encoder for large email lists
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes responses with orjson, including numpy scores."""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
 @app.route("/", methods=["GET"])
 def homepage():
@@ -57,9 +79,17 @@ def homepage():
 def fetch():
     data = request.json
     try:
-        emails = fetch_all_emails(
-            data["imap_host"], data["email"], data["password"], folder=data.get("folder", "INBOX")
-        )
+        if "folders" in data:
+            # Several folders are fetched concurrently and returned keyed by folder name
+            emails = fetch_folders(
+                data["imap_host"], data["email"], data["password"], data["folders"],
+                full_body=data.get("full_body", False)
+            )
+        else:
+            emails = fetch_all_emails(
+                data["imap_host"], data["email"], data["password"], folder=data.get("folder", "INBOX"),
+                full_body=data.get("full_body", False)
+            )
         return jsonify(emails)
     except Exception as e:
         return jsonify({"error": str(e)}), 500